@@ -1,18 +1,22 @@
 from __future__ import annotations
 
+import asyncio
+import contextlib
+import hashlib
 import json
 import math
 import os
 import re
-import urllib.parse
-from collections import Counter
+import time
+from collections import Counter, OrderedDict
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, AsyncIterator, Awaitable, Dict, List, Optional, Sequence, Tuple
 
 import httpx
+import orjson
 from starlette.applications import Starlette
 from starlette.requests import Request
-from starlette.responses import FileResponse, JSONResponse, Response
+from starlette.responses import FileResponse, Response
 from starlette.routing import Mount, Route
 from starlette.staticfiles import StaticFiles
 
@@ -28,6 +32,8 @@ DATA_DIR = BASE_DIR / "data"
 STATIC_DIR = BASE_DIR / "static"
 
 KATHMANDU_CENTER: Tuple[float, float] = (27.7172, 85.3240)
+# Shared default for map_actions; only ever serialized, never mutated.
+_DEFAULT_CENTER: List[float] = list(KATHMANDU_CENTER)
 
 OTHER_CITIES = {
     "pokhara",
@@ -52,8 +58,11 @@ STAY_AREA_PLACE_IDS = {
 }
 
 
+_WORD_RE = re.compile(r"[a-zA-Z']+")
+
+
 def _tokenize(text: str) -> List[str]:
-    return re.findall(r"[a-zA-Z']+", text.lower())
+    return _WORD_RE.findall(text.lower())
 
 
 def _cosine_similarity(a: Counter[str], b: Counter[str]) -> float:
@@ -148,6 +157,76 @@ for p in POIS:
         "review": "A well-loved stop for first-time visitors — easy to reach, and memorable without feeling rushed.",
     }
 
+# Place-id -> raw POI, in catalogue order (first POI wins on id collisions), and the
+# reverse POI name -> place-id so request handlers never re-slugify catalogue names.
+_POI_BY_ID: Dict[str, Dict[str, Any]] = {}
+_PLACE_ID_BY_NAME: Dict[str, str] = {}
+for p in POIS:
+    name = str(p.get("name", ""))
+    pid = _place_id(name)
+    _POI_BY_ID.setdefault(pid, p)
+    _PLACE_ID_BY_NAME.setdefault(name, pid)
+_POIS_ORDERED_IDS: Tuple[str, ...] = tuple(_POI_BY_ID)
+_ALL_POI_IDS = frozenset(_POI_BY_ID)
+
+
+# Commands whose payload is fixed once PLACES is loaded. They are pre-encoded so orjson
+# splices the bytes into each response instead of re-serializing the dicts every turn.
+_STORE_PLACES_CMD = orjson.Fragment(orjson.dumps({"session.storePlaces": PLACES}))
+_PLACE_PICK_CMDS: Dict[str, Tuple[orjson.Fragment, ...]] = {
+    pid: tuple(
+        orjson.Fragment(orjson.dumps(cmd))
+        for cmd in (
+            {"map.addPin": {"id": pid, "lat": place["lat"], "lng": place["lng"], "type": "visit", "color": "blue", "label": place["name_en"]}},
+            {"map.zoomTo": {"lat": place["lat"], "lng": place["lng"], "zoom": 15}},
+            {"ui.showImages": {"placeId": pid, "urls": place.get("images") or []}},
+            {"ui.showReview": {"placeId": pid, "review": str(place.get("review") or "")}},
+        )
+    )
+    for pid, place in PLACES.items()
+}
+
+
+def _place_id_for(name: str) -> str:
+    """Precomputed place-id for catalogue names; falls back to slugifying anything else."""
+    return _PLACE_ID_BY_NAME.get(name) or _place_id(name)
+
+
+# (poi, lowercase name) longest-first, so the first substring hit is the longest match.
+_POI_NAMES_LOWER: List[Tuple[Dict[str, Any], str]] = sorted(
+    ((p, name.lower()) for p in POIS if (name := str(p.get("name", "")).strip())),
+    key=lambda item: -len(item[1]),
+)
+# Exact (case-insensitive) name -> POI; first POI wins, matching the old linear scan.
+_POI_BY_NAME_LOWER: Dict[str, Dict[str, Any]] = {}
+for p in POIS:
+    _POI_BY_NAME_LOWER.setdefault(str(p.get("name", "")).lower(), p)
+
+# A message can only mention a POI if it contains at least one of these characters.
+_POI_FIRST_CHARS = frozenset(n[0] for _, n in _POI_NAMES_LOWER)
+
+
+def _intro_reply() -> str:
+    intro = []
+    for pid in [
+        _place_id("Swayambhunath (Monkey Temple)"),
+        _place_id("Boudhanath Stupa"),
+        _place_id("Garden of Dreams"),
+    ]:
+        p = PLACES.get(pid)
+        if not p:
+            continue
+        intro.append(f"{p['name_en']}: {str(p.get('storyShort') or '').strip()}")
+    return (
+        "Namaste — I’m NomadAI, your Kathmandu-only travel companion.\n\n"
+        + "\n".join(intro[:3])
+        + "\n\nWould you like a personalized plan for Kathmandu?"
+    )
+
+
+# Static per deploy: PLACES never changes after import.
+_INTRO_REPLY = _intro_reply()
+
 
 def _default_trip_state() -> Dict[str, Any]:
     return {
@@ -216,7 +295,8 @@ def _has_buildable_trip(trip_state: Dict[str, Any]) -> bool:
     return False
 
 
-def _candidate_pois(trip_state: Dict[str, Any], limit: int = 3) -> List[Dict[str, Any]]:
+def _candidate_names(trip_state: Dict[str, Any], limit: int = 3) -> List[str]:
+    """Display names of the next unplanned POIs, built once per planned-place signature."""
     planned_ids: set[str] = set()
     try:
         trip = trip_state.get("trip") if isinstance(trip_state, dict) else None
@@ -233,18 +313,26 @@ def _candidate_pois(trip_state: Dict[str, Any], limit: int = 3) -> List[Dict[str
     except Exception:
         planned_ids = set()
 
-    out: List[Dict[str, Any]] = []
-    for p in POIS:
-        pid = _place_id(str(p.get("name", "")))
+    # Picks depend only on what's already planned, so memoize the last result on the state.
+    # A plain tuple of sorted ids compares by value and, unlike a frozenset, keeps trip_state JSON-encodable.
+    key = (tuple(sorted(planned_ids)), limit)
+    cached = trip_state.get("_cand_cache") if isinstance(trip_state, dict) else None
+    if cached and cached[0] == key:
+        return cached[1]
+
+    names: List[str] = []
+    for pid in _POIS_ORDERED_IDS:
         if pid in planned_ids:
             continue
         place = PLACES.get(pid)
         if not place:
             continue
-        out.append(place)
-        if len(out) >= limit:
+        names.append(place["name_en"])
+        if len(names) >= limit:
             break
-    return out
+    if isinstance(trip_state, dict):
+        trip_state["_cand_cache"] = (key, names)
+    return names
 
 
 def _day_preview_text(trip_state: Dict[str, Any], day_index: int) -> Optional[str]:
@@ -254,6 +342,18 @@ def _day_preview_text(trip_state: Dict[str, Any], day_index: int) -> Optional[st
     visits = d.get("visits")
     if not isinstance(visits, list) or not (1 <= len(visits) <= 2):
         return None
+    # The text depends only on the day's visits, so keep the last preview per day.
+    previews = trip_state.setdefault("_previews", {})
+    key = tuple(visits)
+    cached = previews.get(day_index)
+    if cached and cached[0] == key:
+        return cached[1]
+    text = _render_day_preview(day_index, visits)
+    previews[day_index] = (key, text)
+    return text
+
+
+def _render_day_preview(day_index: int, visits: List[str]) -> Optional[str]:
     names = []
     for pid in visits[:2]:
         p = PLACES.get(str(pid))
@@ -286,6 +386,8 @@ def _default_session() -> Dict[str, Any]:
     return {
         "trip_state": _default_trip_state(),
         "history": [],
+        # Bumped whenever trip_profile changes; keys the storeProfile export cache.
+        "_profile_version": 0,
     }
 
 
@@ -297,8 +399,7 @@ def _compact_state(trip_state: Dict[str, Any]) -> str:
 
 
 def _is_outside_kathmandu(message: str) -> bool:
-    tokens = set(_tokenize(message))
-    return any(c in tokens for c in OTHER_CITIES)
+    return not OTHER_CITIES.isdisjoint(_tokenize(message))
 
 
 def _looks_like_place_name(message: str) -> Optional[str]:
@@ -315,46 +416,160 @@ def _looks_like_save_day(message: str) -> bool:
     return any(k in m for k in ["save day", "confirm day", "save this day", "save it", "confirm it"])
 
 
+# Shared client so Ollama and per-leg OSRM calls reuse pooled (HTTP/2) connections.
+_HTTP: Optional[httpx.AsyncClient] = None
+
+
+def _http_client() -> httpx.AsyncClient:
+    global _HTTP
+    if _HTTP is None or _HTTP.is_closed:
+        # keepalive_expiry stays under typical server idle cut-offs; retries=1 absorbs connect resets.
+        _HTTP = httpx.AsyncClient(
+            timeout=httpx.Timeout(30.0, connect=3.0, pool=5.0),
+            transport=httpx.AsyncHTTPTransport(
+                http2=True,
+                retries=1,
+                limits=httpx.Limits(max_connections=64, max_keepalive_connections=16, keepalive_expiry=30.0),
+            ),
+        )
+    return _HTTP
+
+
+# Opt-in (LLM_REPLY_TIMEOUT > 0): upper bound on how long a chat turn waits for Ollama before
+# using its static reply. Unset, only the per-call httpx timeouts apply.
+LLM_REPLY_TIMEOUT = float(os.environ.get("LLM_REPLY_TIMEOUT", "0"))
+
+
+async def _llm_or_fallback(pending: Awaitable[str], fallback: str) -> str:
+    """Await an LLM reply, returning fallback on timeout, HTTP failure, or an empty reply."""
+    try:
+        reply = await asyncio.wait_for(pending, timeout=LLM_REPLY_TIMEOUT if LLM_REPLY_TIMEOUT > 0 else None)
+    except (asyncio.TimeoutError, httpx.HTTPError):
+        return fallback
+    return reply if reply and reply.strip() else fallback
+
+
+def _env_seed() -> Optional[int]:
+    """OLLAMA_SEED as an int, or None when unset; a non-integer value fails at startup."""
+    raw = os.environ.get("OLLAMA_SEED", "").strip()
+    if not raw:
+        return None
+    try:
+        return int(raw)
+    except ValueError:
+        raise RuntimeError(f"OLLAMA_SEED must be an integer, got {raw!r}") from None
+
+
+OLLAMA_SEED = _env_seed()
+
+# Sent with every Ollama request: Ollama resets a model's unload timer on each call using that
+# call's keep_alive, so it has to ride along on chat/generate too, not just the warmup.
+OLLAMA_KEEP_ALIVE = os.environ.get("LLM_KEEP_ALIVE", "30m")
+
+
+def _ollama_options(**options: Any) -> Dict[str, Any]:
+    """Ollama sampling options; OLLAMA_SEED pins seed and temperature 0 for reproducible replies."""
+    if OLLAMA_SEED is not None:
+        options.update(seed=OLLAMA_SEED, temperature=0)
+    return options
+
+
+# Fixed head of the main chat() system prompt; the per-turn trip context is appended after it,
+# so Ollama can reuse the KV-cache for these tokens across turns and sessions.
+CHAT_SYSTEM_PREFIX = (
+    "You are Aarav, a calm, experienced Kathmandu local guide. "
+    "Speak naturally and warmly, like a real person, not an AI. "
+    "Help the user plan their Kathmandu trip by asking natural questions about their stay. "
+    "Find out about: how many days, group size, budget comfort level, and interests. "
+    "Don't use forms or lists - just have a natural conversation. "
+    "Once you understand their needs, help them choose a stay area and plan day-by-day activities. "
+    "Keep responses conversational and brief (2-4 sentences)."
+)
+
+
+async def _warm_ollama() -> None:
+    """Load the model and prefill CHAT_SYSTEM_PREFIX so the first chat turn skips the cold start."""
+    model = os.environ.get("OLLAMA_MODEL", "llama3.1:8b")
+    url = os.environ.get("OLLAMA_URL", "http://localhost:11434")
+    payload = {
+        "model": model,
+        "messages": [{"role": "system", "content": CHAT_SYSTEM_PREFIX}],
+        "stream": False,
+        "keep_alive": OLLAMA_KEEP_ALIVE,
+        "options": _ollama_options(num_predict=1),
+    }
+    with contextlib.suppress(httpx.HTTPError):
+        await _http_client().post(f"{url}/api/chat", json=payload, timeout=httpx.Timeout(120.0, connect=3.0, pool=5.0))
+
+
 async def _ollama_generate(prompt: str) -> str:
     model = os.environ.get("OLLAMA_MODEL", "llama3.1:8b")
     url = os.environ.get("OLLAMA_URL", "http://localhost:11434")
 
-    payload = {"model": model, "prompt": prompt, "stream": False}
+    payload = {
+        "model": model,
+        "prompt": prompt,
+        "stream": False,
+        "keep_alive": OLLAMA_KEEP_ALIVE,
+        "options": _ollama_options(),
+    }
+
+    timeout = httpx.Timeout(60.0, connect=5.0, pool=5.0)
+    r = await _http_client().post(f"{url}/api/generate", json=payload, timeout=timeout)
+    r.raise_for_status()
+    data = r.json()
+    text = str(data.get("response", "")).strip()
+    return text
 
-    timeout = httpx.Timeout(60.0, connect=5.0)
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        r = await client.post(f"{url}/api/generate", json=payload)
-        r.raise_for_status()
-        data = r.json()
-        text = str(data.get("response", "")).strip()
-        return text
+
+# Opt-in (LLM_CACHE_TTL > 0): replies for byte-identical (model, options, messages) prompts are
+# reused for that many seconds. The system prompt embeds the trip context, so a hit means same
+# state and same user message.
+LLM_CACHE_TTL = float(os.environ.get("LLM_CACHE_TTL", "0"))
+_LLM_CACHE_MAX = 256
+_LLM_CACHE: OrderedDict[str, Tuple[float, str]] = OrderedDict()
 
 
 async def _ollama_chat(messages: List[Dict[str, str]]) -> str:
     model = os.environ.get("OLLAMA_MODEL", "llama3.1:8b")
     url = os.environ.get("OLLAMA_URL", "http://localhost:11434")
 
+    options = _ollama_options(
+        temperature=0.7,
+        top_p=0.9,
+        max_tokens=300,  # Limit response length for speed
+        num_predict=300,  # Alternative max_tokens for some models
+    )
+
+    key = None
+    if LLM_CACHE_TTL > 0:
+        key = hashlib.sha256(orjson.dumps([model, options, messages], option=orjson.OPT_SORT_KEYS)).hexdigest()
+        hit = _LLM_CACHE.get(key)
+        if hit and time.monotonic() - hit[0] < LLM_CACHE_TTL:
+            _LLM_CACHE.move_to_end(key)
+            return hit[1]
+
     payload = {
         "model": model, 
         "messages": messages, 
         "stream": False,
-        "options": {
-            "temperature": 0.7,
-            "top_p": 0.9,
-            "max_tokens": 300,  # Limit response length for speed
-            "num_predict": 300   # Alternative max_tokens for some models
-        }
+        "keep_alive": OLLAMA_KEEP_ALIVE,
+        "options": options,
     }
 
     # Reduced timeout for faster failure detection
-    timeout = httpx.Timeout(30.0, connect=3.0)
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        r = await client.post(f"{url}/api/chat", json=payload)
-        r.raise_for_status()
-        data = r.json()
-        msg = data.get("message") or {}
-        text = str(msg.get("content", "")).strip()
-        return text
+    timeout = httpx.Timeout(30.0, connect=3.0, pool=5.0)
+    r = await _http_client().post(f"{url}/api/chat", json=payload, timeout=timeout)
+    r.raise_for_status()
+    data = r.json()
+    msg = data.get("message") or {}
+    text = str(msg.get("content", "")).strip()
+    if key is not None and text:
+        _LLM_CACHE[key] = (time.monotonic(), text)
+        _LLM_CACHE.move_to_end(key)
+        while len(_LLM_CACHE) > _LLM_CACHE_MAX:
+            _LLM_CACHE.popitem(last=False)
+    return text
 
 
 def _context_for_llm(trip_state: Dict[str, Any]) -> str:
@@ -672,7 +887,6 @@ async def _get_relevant_stories(query: str, limit: int = 2) -> List[Dict[str, An
     """Retrieve relevant stories using RAG for LLM context."""
     try:
         # Add timeout to prevent hanging
-        import asyncio
         return await asyncio.wait_for(RAG.retrieve(query, top_k=limit), timeout=2.0)
     except Exception:
         return []
@@ -767,27 +981,21 @@ def _rag_text_for_query(query: str, top_k: int = 3) -> str:
 
 
 def _find_poi_by_name(name: str) -> Optional[Dict[str, Any]]:
-    for p in POIS:
-        if str(p.get("name", "")).lower() == name.lower():
-            return p
-    return None
+    return _POI_BY_NAME_LOWER.get(name.lower())
+
+
+# "I'm staying in X" / "I am staying near X" / "staying in X" / "my hotel is near X"
+_STAY_AREA_RE = re.compile(r"^(?:(?:i\s*['’]?m|i\s+am)\s+staying|staying|my\s+hotel\s+is)\s+(?:in|near)\s+(.+)$")
+_TRAILING_PUNCT_RE = re.compile(r"[\.!\?]+$")
 
 
 def _maybe_extract_stay_area(message: str) -> Optional[str]:
     m = message.strip().lower()
-    patterns = [
-        r"^i\s*['’]?m\s+staying\s+(?:in|near)\s+(.+)$",
-        r"^i\s+am\s+staying\s+(?:in|near)\s+(.+)$",
-        r"^staying\s+(?:in|near)\s+(.+)$",
-        r"^my\s+hotel\s+is\s+(?:in|near)\s+(.+)$",
-    ]
-    for pat in patterns:
-        mm = re.match(pat, m)
-        if mm:
-            area = mm.group(1).strip()
-            area = re.sub(r"[\.!\?]+$", "", area).strip()
-            return area if area else None
-    return None
+    mm = _STAY_AREA_RE.match(m)
+    if not mm:
+        return None
+    area = _TRAILING_PUNCT_RE.sub("", mm.group(1).strip()).strip()
+    return area if area else None
 
 
 def _looks_like_build_route(message: str) -> bool:
@@ -832,21 +1040,20 @@ def _looks_like_exact_prices(message: str) -> bool:
     ) and any(k in m for k in ["price", "cost", "fee", "budget", "rupees", "rs", "usd", "$", "dollar"])
 
 
+# Use word boundaries to avoid false positives like "family" containing "ai"
+_OFF_TOPIC_RE = re.compile(r"\b(?:ai|llm|model|ollama|prompt|token|fine\s*tune|api|openai)\b")
+
+
+# Every _OFF_TOPIC_RE hit contains one of these \w+ tokens; most messages share none and skip the regex.
+_OFF_TOPIC_TOKENS = frozenset({"ai", "llm", "model", "ollama", "prompt", "token", "api", "openai", "fine", "finetune"})
+_WORD_CHARS_RE = re.compile(r"\w+")
+
+
 def _looks_like_off_topic(message: str) -> bool:
     m = message.strip().lower()
-    # Use word boundaries to avoid false positives like "family" containing "ai"
-    patterns = [
-        r'\bai\b',
-        r'\bllm\b',
-        r'\bmodel\b',
-        r'\bollama\b',
-        r'\bprompt\b',
-        r'\btoken\b',
-        r'\bfine\s*tune\b',
-        r'\bapi\b',
-        r'\bopenai\b',
-    ]
-    return any(re.search(pattern, m) for pattern in patterns)
+    if _OFF_TOPIC_TOKENS.isdisjoint(_WORD_CHARS_RE.findall(m)):
+        return False
+    return bool(_OFF_TOPIC_RE.search(m))
 
 
 def _looks_like_vague_or_confused(message: str) -> bool:
@@ -869,15 +1076,23 @@ def _looks_like_change_of_mind(message: str) -> bool:
     return any(k in m for k in ["never mind", "nevermind", "actually", "change of plan", "instead"])
 
 
+_BARE_NUMBER_RE = re.compile(r"\d{1,2}")
+_TIME_DAYS_RE = re.compile(r"\b(\d{1,2})\s*(day|days|week|weeks)\b")
+_GROUP_WE_ARE_RE = re.compile(r"\bwe\s+are\s+(\d{1,2})\b")
+_GROUP_COUNT_RE = re.compile(r"\b(\d{1,2})\s*(people|persons|friends|travelers|travellers)\b")
+_BUDGET_DOLLAR_RE = re.compile(r"\$\s*(\d+(?:\.\d+)?)")
+_BUDGET_USD_RE = re.compile(r"\b(\d+(?:\.\d+)?)\s*(usd|dollars|dollar)\b")
+
+
 def _parse_time_days(message: str) -> Optional[int]:
     m = message.strip().lower()
     # Common UX: user answers with a bare number (e.g. "2") when asked "How many days?"
     # We accept that as "N days" (with a small sanity bound).
-    if re.fullmatch(r"\d{1,2}", m):
+    if _BARE_NUMBER_RE.fullmatch(m):
         n = int(m)
         if 1 <= n <= 14:
             return n
-    mm = re.search(r"\b(\d{1,2})\s*(day|days|week|weeks)\b", m)
+    mm = _TIME_DAYS_RE.search(m)
     if not mm:
         return None
     n = int(mm.group(1))
@@ -898,9 +1113,9 @@ def _parse_group(message: str) -> Optional[Dict[str, Any]]:
     if any(k in m for k in ["couple", "duo", "two of us", "we two"]):
         return {"label": "duo", "count": 2}
 
-    mm = re.search(r"\bwe\s+are\s+(\d{1,2})\b", m)
+    mm = _GROUP_WE_ARE_RE.search(m)
     if not mm:
-        mm = re.search(r"\b(\d{1,2})\s*(people|persons|friends|travelers|travellers)\b", m)
+        mm = _GROUP_COUNT_RE.search(m)
     if mm:
         n = int(mm.group(1))
         if n <= 0:
@@ -911,33 +1126,37 @@ def _parse_group(message: str) -> Optional[Dict[str, Any]]:
     return None
 
 
+# Substring probes, likeliest hit first; entries implied by a shorter one ("keep it flexible",
+# "mid-range") are left out since `any` would have matched the shorter one already.
+_BUDGET_UNSURE_KEYS = (
+    "flexible",
+    "not sure",
+    "no budget",
+    "don't know",
+    "dont know",
+    "no idea",
+    "haven't decided",
+    "have not decided",
+    "don't have a budget",
+    "dont have a budget",
+    "no rough budget",
+    "don't have a rough budget",
+    "dont have a rough budget",
+)
+_COMFORT_BUDGET_KEYS = ("budget", "cheap", "backpacker", "hostel", "basic")
+_COMFORT_MID_KEYS = ("mid", "comfortable", "standard", "3 star", "3-star")
+_COMFORT_LUXURY_KEYS = ("luxury", "premium", "5 star", "5-star", "high-end")
+
+
 def _parse_budget(message: str) -> Tuple[Optional[float], Optional[bool]]:
     m = message.strip().lower()
 
-    if any(
-        k in m
-        for k in [
-            "don't know",
-            "dont know",
-            "not sure",
-            "no idea",
-            "haven't decided",
-            "have not decided",
-            "no budget",
-            "don't have a budget",
-            "dont have a budget",
-            "no rough budget",
-            "don't have a rough budget",
-            "dont have a rough budget",
-            "keep it flexible",
-            "flexible",
-        ]
-    ):
+    if any(k in m for k in _BUDGET_UNSURE_KEYS):
         return None, True
 
-    mm = re.search(r"\$\s*(\d+(?:\.\d+)?)", m)
+    mm = _BUDGET_DOLLAR_RE.search(m)
     if not mm:
-        mm = re.search(r"\b(\d+(?:\.\d+)?)\s*(usd|dollars|dollar)\b", m)
+        mm = _BUDGET_USD_RE.search(m)
     if mm:
         return float(mm.group(1)), False
 
@@ -946,11 +1165,11 @@ def _parse_budget(message: str) -> Tuple[Optional[float], Optional[bool]]:
 
 def _parse_comfort(message: str) -> Optional[str]:
     m = message.strip().lower()
-    if any(k in m for k in ["budget", "cheap", "backpacker", "hostel", "basic"]):
+    if any(k in m for k in _COMFORT_BUDGET_KEYS):
         return "budget"
-    if any(k in m for k in ["mid", "mid-range", "midrange", "comfortable", "standard", "3 star", "3-star"]):
+    if any(k in m for k in _COMFORT_MID_KEYS):
         return "mid"
-    if any(k in m for k in ["luxury", "premium", "5 star", "5-star", "high-end"]):
+    if any(k in m for k in _COMFORT_LUXURY_KEYS):
         return "comfortable"
     return None
 
@@ -974,45 +1193,80 @@ def _parse_preferences(message: str) -> List[str]:
     return sorted(set(prefs))
 
 
-def _update_trip_profile_from_message(trip_state: Dict[str, Any], message: str) -> None:
+def _update_trip_profile_from_message(trip_state: Dict[str, Any], message: str) -> bool:
+    """Merge profile facts parsed from message; returns True if the profile changed."""
     if not message:
-        return
+        return False
 
+    changed = False
     profile = trip_state.get("trip_profile")
     if not isinstance(profile, dict):
         profile = {}
         trip_state["trip_profile"] = profile
+        changed = True
 
     td = _parse_time_days(message)
     if td is not None and not profile.get("time_days"):
         profile["time_days"] = td
+        changed = True
 
     group = _parse_group(message)
     if group is not None and not profile.get("group"):
         profile["group"] = group
+        changed = True
 
     budget_value, budget_unknown = _parse_budget(message)
     if budget_value is not None and profile.get("budget") is None:
         profile["budget"] = budget_value
         profile["budget_unknown"] = False
+        changed = True
     if budget_unknown is True and profile.get("budget_unknown") is None and profile.get("budget") is None:
         profile["budget_unknown"] = True
+        changed = True
 
     comfort = _parse_comfort(message)
     if comfort is not None and not profile.get("comfort"):
         profile["comfort"] = comfort
+        changed = True
 
     prefs = _parse_preferences(message)
     if prefs:
         existing = profile.get("preferences")
         if not isinstance(existing, list):
             existing = []
-        profile["preferences"] = sorted(set([str(x) for x in existing] + prefs))
+        merged = sorted(set([str(x) for x in existing] + prefs))
+        if merged != existing:
+            profile["preferences"] = merged
+            changed = True
+    return changed
 
 
 # Removed unused profile collection functions - LLM handles everything naturally now
 
 
+def _ensure_trip_state_shape(trip_state: Dict[str, Any]) -> Dict[str, Any]:
+    """Guarantee trip_profile is a dict, trip.days a list and every day's visits a list.
+
+    Run once when a session is created so chat() can index these without per-turn type guards.
+    """
+    defaults = _default_trip_state()
+    if not isinstance(trip_state.get("trip_profile"), dict):
+        trip_state["trip_profile"] = defaults["trip_profile"]
+    trip = trip_state.get("trip")
+    if not isinstance(trip, dict):
+        trip = defaults["trip"]
+        trip_state["trip"] = trip
+    days = trip.get("days")
+    if not isinstance(days, list):
+        days = []
+    trip["days"] = days = [d for d in days if isinstance(d, dict)]
+    for d in days:
+        if not isinstance(d.get("visits"), list):
+            d["visits"] = []
+    trip.pop("_days_by_index", None)
+    return trip_state
+
+
 def _ensure_session(session_id: Optional[str]) -> Tuple[str, Dict[str, Any]]:
     if session_id and session_id in SESSIONS:
         return session_id, SESSIONS[session_id]
@@ -1020,11 +1274,19 @@ def _ensure_session(session_id: Optional[str]) -> Tuple[str, Dict[str, Any]]:
     import uuid
 
     sid = session_id or str(uuid.uuid4())
-    SESSIONS[sid] = _default_session()
-    return sid, SESSIONS[sid]
+    session = _default_session()
+    _ensure_trip_state_shape(session["trip_state"])
+    SESSIONS[sid] = session
+    return sid, session
+
+
+def _bump_map_version(trip_state: Dict[str, Any]) -> None:
+    """Invalidate the cached map_actions; call after changing hotel, selected places, routes or map view."""
+    trip_state["_mv"] = trip_state.get("_mv", 0) + 1
 
 
 def _upsert_selected_place(trip_state: Dict[str, Any], name: str, coordinates: List[float]) -> None:
+    _bump_map_version(trip_state)
     existing = trip_state.get("selected_places", [])
     for p in existing:
         if str(p.get("name", "")).lower() == name.lower():
@@ -1036,6 +1298,8 @@ def _upsert_selected_place(trip_state: Dict[str, Any], name: str, coordinates: L
 
 def _set_hotel(trip_state: Dict[str, Any], name: str, coordinates: List[float]) -> None:
     trip_state["hotel"] = {"name": name, "coordinates": coordinates}
+    _bump_map_version(trip_state)
+    trip_state["_buildable"] = _has_buildable_trip(trip_state)
 
 
 def _build_routes(trip_state: Dict[str, Any]) -> List[Dict[str, Any]]:
@@ -1113,18 +1377,17 @@ async def _osrm_leg_polyline(a: List[float], b: List[float]) -> Optional[List[Li
         "steps": "false",
     }
 
-    timeout = httpx.Timeout(15.0, connect=5.0)
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        r = await client.get(url, params=params)
-        r.raise_for_status()
-        data = r.json()
-        routes = data.get("routes") or []
-        if not routes:
-            return None
-        geom = (routes[0].get("geometry") or {}).get("coordinates")
-        if not isinstance(geom, list) or len(geom) < 2:
-            return None
-        return [[c[1], c[0]] for c in geom if isinstance(c, list) and len(c) == 2]
+    timeout = httpx.Timeout(15.0, connect=5.0, pool=5.0)
+    r = await _http_client().get(url, params=params, timeout=timeout)
+    r.raise_for_status()
+    data = r.json()
+    routes = data.get("routes") or []
+    if not routes:
+        return None
+    geom = (routes[0].get("geometry") or {}).get("coordinates")
+    if not isinstance(geom, list) or len(geom) < 2:
+        return None
+    return [[c[1], c[0]] for c in geom if isinstance(c, list) and len(c) == 2]
 
 
 async def _build_routes_osrm(trip_state: Dict[str, Any]) -> List[Dict[str, Any]]:
@@ -1164,7 +1427,7 @@ def _suggestions_for_state(trip_state: Dict[str, Any]) -> List[str]:
         for p in trip_state.get("selected_places", []) or []:
             n = str(p.get("name", ""))
             if n:
-                planned_ids.add(_place_id(n))
+                planned_ids.add(_place_id_for(n))
     except Exception:
         planned_ids = set()
 
@@ -1186,13 +1449,9 @@ def _suggestions_for_state(trip_state: Dict[str, Any]) -> List[str]:
         suggestions.append("I'm staying near Durbar Square")
 
     if not trip_state.get("selected_places"):
-        for p in POIS:
-            pid = _place_id(str(p.get("name", "")))
-            if pid in planned_ids:
-                continue
-            suggestions.append(f"Tell me about {p['name']}")
-            if len(suggestions) >= 5:
-                break
+        available_ids = _ALL_POI_IDS - planned_ids
+        picks = [i for i in _POIS_ORDERED_IDS if i in available_ids][: max(5 - len(suggestions), 1)]
+        suggestions.extend(f"Tell me about {_POI_BY_ID[i]['name']}" for i in picks)
     else:
         suggestions.append("Build a simple route for me")
         suggestions.append("Add a calm place for a break")
@@ -1202,8 +1461,13 @@ def _suggestions_for_state(trip_state: Dict[str, Any]) -> List[str]:
 
 
 def _map_actions_from_state(trip_state: Dict[str, Any]) -> Dict[str, Any]:
+    version = trip_state.get("_mv", 0)
+    cached = trip_state.get("_map_actions_cache")
+    if cached and cached[0] == version:
+        return cached[1]
+
     view = trip_state.get("map_view") if isinstance(trip_state, dict) else None
-    center = list(KATHMANDU_CENTER)
+    center = _DEFAULT_CENTER
     zoom = 13
     if isinstance(view, dict):
         c = view.get("center")
@@ -1213,17 +1477,16 @@ def _map_actions_from_state(trip_state: Dict[str, Any]) -> Dict[str, Any]:
         if isinstance(z, int):
             zoom = z
 
-    actions: Dict[str, Any] = {"center": center, "zoom": zoom, "markers": [], "routes": []}
-
+    markers: List[Dict[str, Any]] = []
     if trip_state.get("hotel"):
-        actions["markers"].append({"type": "hotel", **trip_state["hotel"]})
-
-    for p in trip_state.get("selected_places", []):
-        actions["markers"].append({"type": "place", "name": p["name"], "coordinates": p["coordinates"]})
-
-    for r in trip_state.get("routes", []):
-        actions["routes"].append(r)
+        markers.append({"type": "hotel", **trip_state["hotel"]})
+    markers.extend(
+        {"type": "place", "name": p["name"], "coordinates": p["coordinates"]}
+        for p in trip_state.get("selected_places", [])
+    )
 
+    actions = {"center": center, "zoom": zoom, "markers": markers, "routes": list(trip_state.get("routes", []))}
+    trip_state["_map_actions_cache"] = (version, actions)
     return actions
 
 
@@ -1233,6 +1496,7 @@ def _set_map_view(trip_state: Dict[str, Any], center: List[float], zoom: int = 1
     if not (isinstance(center, list) and len(center) == 2):
         return
     trip_state["map_view"] = {"center": center, "zoom": zoom}
+    _bump_map_version(trip_state)
 
 
 def _find_poi_mention(message: str) -> Optional[Dict[str, Any]]:
@@ -1240,17 +1504,12 @@ def _find_poi_mention(message: str) -> Optional[Dict[str, Any]]:
     if not m:
         return None
 
-    best = None
-    best_len = 0
-    for p in POIS:
-        name = str(p.get("name", "")).strip()
-        if not name:
-            continue
-        n = name.lower()
-        if n in m and len(n) > best_len:
-            best = p
-            best_len = len(n)
-    return best
+    if _POI_FIRST_CHARS.isdisjoint(m):
+        return None
+    for poi, n in _POI_NAMES_LOWER:
+        if n in m:
+            return poi
+    return None
 
 
 def _looks_like_affirmation(message: str) -> bool:
@@ -1284,14 +1543,28 @@ def _split_into_days(items: List[Any], days: int) -> List[List[Any]]:
 def _google_maps_dir_link(points: List[List[float]]) -> Optional[str]:
     if not points or len(points) < 2:
         return None
-    origin = f"{points[0][0]},{points[0][1]}"
-    destination = f"{points[-1][0]},{points[-1][1]}"
-    waypoints = "|".join(f"{p[0]},{p[1]}" for p in points[1:-1])
+    # 6 decimals (~11 cm) is well within Google Maps accuracy and avoids full float repr.
+    origin = "%.6f,%.6f" % (points[0][0], points[0][1])
+    destination = "%.6f,%.6f" % (points[-1][0], points[-1][1])
+    waypoints = "|".join(["%.6f,%.6f" % (p[0], p[1]) for p in points[1:-1]])
 
-    params = {"api": "1", "origin": origin, "destination": destination}
+    # Coordinates only contain digits, '.', '-', ',' and '|', none of which need quoting.
+    url = f"https://www.google.com/maps/dir/?api=1&origin={origin}&destination={destination}"
     if waypoints:
-        params["waypoints"] = waypoints
-    return "https://www.google.com/maps/dir/?" + urllib.parse.urlencode(params, safe=",|")
+        url += f"&waypoints={waypoints}"
+    return url
+
+
+def _days_index(trip: Dict[str, Any]) -> Dict[int, Dict[str, Any]]:
+    """dayIndex -> day dict for trip["days"], kept on the trip as "_days_by_index"."""
+    index = trip.get("_days_by_index")
+    if not isinstance(index, dict):
+        index = {}
+        for d in trip.get("days") or []:
+            if isinstance(d, dict) and isinstance(d.get("dayIndex"), int):
+                index.setdefault(d["dayIndex"], d)
+        trip["_days_by_index"] = index
+    return index
 
 
 def _ensure_trip_days(trip_state: Dict[str, Any], stay_days: int) -> None:
@@ -1305,12 +1578,16 @@ def _ensure_trip_days(trip_state: Dict[str, Any], stay_days: int) -> None:
     if not isinstance(days, list):
         days = []
         trip["days"] = days
+        trip.pop("_days_by_index", None)
     if stay_days <= 0:
         return
     if len(days) >= stay_days:
         return
+    index = _days_index(trip)
     for i in range(len(days) + 1, stay_days + 1):
-        days.append({"dayIndex": i, "hotelPlaceId": None, "visits": [], "confirmed": False})
+        d = {"dayIndex": i, "hotelPlaceId": None, "visits": [], "confirmed": False}
+        days.append(d)
+        index.setdefault(i, d)
 
 
 def _current_day_index(trip_state: Dict[str, Any]) -> int:
@@ -1331,11 +1608,18 @@ def _find_day(trip_state: Dict[str, Any], day_index: int) -> Dict[str, Any]:
     if not isinstance(days, list):
         days = []
         trip["days"] = days
+        trip.pop("_days_by_index", None)
+    index = _days_index(trip)
+    d = index.get(day_index)
+    if d is not None:
+        return d
     for d in days:
         if isinstance(d, dict) and d.get("dayIndex") == day_index:
+            index[day_index] = d
             return d
     d = {"dayIndex": day_index, "hotelPlaceId": None, "visits": [], "confirmed": False}
     days.append(d)
+    index[day_index] = d
     return d
 
 
@@ -1359,6 +1643,8 @@ def _add_visit_to_day(trip_state: Dict[str, Any], day_index: int, place_id: str)
 def _confirm_day(trip_state: Dict[str, Any], day_index: int) -> None:
     d = _find_day(trip_state, day_index)
     d["confirmed"] = True
+    # Buildability only changes when a hotel is set or a day is confirmed; chat() reads this flag.
+    trip_state["_buildable"] = _has_buildable_trip(trip_state)
     trip = trip_state.get("trip") if isinstance(trip_state, dict) else None
     if isinstance(trip, dict):
         trip["current_day"] = max(day_index + 1, int(trip.get("current_day") or 1))
@@ -1408,10 +1694,19 @@ def _export_user_profile(trip_state: Dict[str, Any]) -> Dict[str, Any]:
     return out
 
 
-def export_plan(request: Request) -> JSONResponse:
+def _json(payload: Any, status_code: int = 200) -> Response:
+    """orjson-encoded drop-in for JSONResponse."""
+    return Response(
+        orjson.dumps(payload, default=str, option=orjson.OPT_NON_STR_KEYS),
+        status_code=status_code,
+        media_type="application/json",
+    )
+
+
+def export_plan(request: Request) -> Response:
     session_id_value = request.query_params.get("session_id")
     if not isinstance(session_id_value, str) or not session_id_value or session_id_value not in SESSIONS:
-        return JSONResponse({"ok": False, "error": "missing_session"}, status_code=400)
+        return _json({"ok": False, "error": "missing_session"}, status_code=400)
 
     session = SESSIONS[session_id_value]
     trip_state = session.get("trip_state") or {}
@@ -1459,28 +1754,84 @@ def export_plan(request: Request) -> JSONResponse:
             continue
         links.append({"day": day_index, "url": url})
 
-    return JSONResponse({"ok": True, "days": len(days_list), "links": links})
+    return _json({"ok": True, "days": len(days_list), "links": links})
+
+
+# /static URLs are not fingerprinted, so by default browsers revalidate (ETag/304) on every load;
+# a positive STATIC_MAX_AGE opts into a fixed lifetime for deploys that version their assets.
+STATIC_MAX_AGE = int(os.environ.get("STATIC_MAX_AGE", "0"))
+
+
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles plus an explicit Cache-Control policy.
+
+    Starlette already serves these through FileResponse with a precomputed stat result,
+    ETag/Last-Modified headers and 304 handling; this sets how long browsers may skip it.
+    """
+
+    def file_response(self, *args: Any, **kwargs: Any) -> Response:
+        response = super().file_response(*args, **kwargs)
+        cache_control = f"public, max-age={STATIC_MAX_AGE}" if STATIC_MAX_AGE > 0 else "no-cache"
+        response.headers.setdefault("Cache-Control", cache_control)
+        return response
 
 
 def index(request: Request) -> Response:
     return FileResponse(str(STATIC_DIR / "index.html"))
 
 
-def health(request: Request) -> JSONResponse:
-    return JSONResponse({"ok": True})
+def health(request: Request) -> Response:
+    return _json({"ok": True})
 
 
-def pois(request: Request) -> JSONResponse:
-    return JSONResponse(POIS)
+def pois(request: Request) -> Response:
+    return _json(POIS)
 
 
-def places(request: Request) -> JSONResponse:
-    return JSONResponse({"places": list(PLACES.values())})
+def places(request: Request) -> Response:
+    return _json({"places": list(PLACES.values())})
+
+
+TRIP_DONE_SUGGESTIONS: Tuple[str, ...] = (
+    "Tell me about my planned places",
+    "How much money should I bring?",
+    "Can I modify my trip?",
+)
+
+
+def _public_trip_state(trip_state: Dict[str, Any]) -> Dict[str, Any]:
+    """Shallow view of trip_state without the underscore-prefixed server-side caches."""
+    out = {k: v for k, v in trip_state.items() if not k.startswith("_")}
+    trip = out.get("trip")
+    if isinstance(trip, dict):
+        out["trip"] = {k: v for k, v in trip.items() if not k.startswith("_")}
+    return out
+
+
+def _respond(
+    session_id: str,
+    reply: str,
+    trip_state: Dict[str, Any],
+    commands: List[Any],
+    suggestions: Sequence[str] = (),
+) -> Response:
+    """Build the chat reply envelope shared by every branch of chat()."""
+    return _json(
+        {
+            "session_id": session_id,
+            "message": reply,
+            "reply": reply,
+            "commands": commands,
+            "trip_state": _public_trip_state(trip_state),
+            "map_actions": _map_actions_from_state(trip_state),
+            "suggestions": list(suggestions),
+        }
+    )
 
 
-async def chat(request: Request) -> JSONResponse:
+async def chat(request: Request) -> Response:
     try:
-        payload = await request.json()
+        payload = orjson.loads(await request.body())
         if not isinstance(payload, dict):
             payload = {}
     except Exception:
@@ -1501,51 +1852,31 @@ async def chat(request: Request) -> JSONResponse:
     trip_state = session["trip_state"]
     history: List[Dict[str, str]] = session["history"]
 
-    commands: List[Dict[str, Any]] = []
+    # Plain dicts, or pre-encoded orjson.Fragment commands for static payloads.
+    commands: List[Any] = []
 
-    commands.append({"session.storePlaces": PLACES})
+    commands.append(_STORE_PLACES_CMD)
 
     if message and trip_state.get("planning_permission") is True:
-        _update_trip_profile_from_message(trip_state, message)
+        if _update_trip_profile_from_message(trip_state, message):
+            session["_profile_version"] = session.get("_profile_version", 0) + 1
 
-    commands.append({"session.storeProfile": _export_user_profile(trip_state)})
+    profile_version = session.get("_profile_version", 0)
+    if session.get("_profile_version_exported") != profile_version:
+        session["_profile_export_cache"] = _export_user_profile(trip_state)
+        session["_profile_version_exported"] = profile_version
+    commands.append({"session.storeProfile": session["_profile_export_cache"]})
 
-    profile = trip_state.get("trip_profile") if isinstance(trip_state, dict) else None
-    if isinstance(profile, dict):
-        td = profile.get("time_days")
-        if isinstance(td, int) and td > 0:
-            _ensure_trip_days(trip_state, min(td, 14))
+    td = trip_state["trip_profile"].get("time_days")
+    if isinstance(td, int) and td > 0:
+        _ensure_trip_days(trip_state, min(td, 14))
 
     if not message and not map_event:
-        intro = []
-        for pid in [
-            _place_id("Swayambhunath (Monkey Temple)"),
-            _place_id("Boudhanath Stupa"),
-            _place_id("Garden of Dreams"),
-        ]:
-            p = PLACES.get(pid)
-            if not p:
-                continue
-            intro.append(f"{p['name_en']}: {str(p.get('storyShort') or '').strip()}")
-        reply = (
-            "Namaste — I’m NomadAI, your Kathmandu-only travel companion.\n\n"
-            + "\n".join(intro[:3])
-            + "\n\nWould you like a personalized plan for Kathmandu?"
-        )
+        reply = _INTRO_REPLY
         trip_state["ui_stage"] = "intro"
         if trip_state.get("planning_permission") is None:
             trip_state["planning_permission"] = None
-        return JSONResponse(
-            {
-                "session_id": session_id,
-                "message": reply,
-                "reply": reply,
-                "commands": commands,
-                "trip_state": trip_state,
-                "map_actions": _map_actions_from_state(trip_state),
-                "suggestions": ["Yes", "No"],
-            }
-        )
+        return _respond(session_id, reply, trip_state, commands, suggestions=["Yes", "No"])
 
     # Let LLM handle the entire conversation naturally
     if message and trip_state.get("planning_permission") is None:
@@ -1560,117 +1891,54 @@ async def chat(request: Request) -> JSONResponse:
     if trip_state.get("planning_permission") is not False:
         # Use LLM for all responses
         context = _context_for_llm(trip_state)
-        system_prompt = (
-            "You are Aarav, a calm, experienced Kathmandu local guide. "
-            "Speak naturally and warmly, like a real person, not an AI. "
-            "Help the user plan their Kathmandu trip by asking natural questions about their stay. "
-            "Find out about: how many days, group size, budget comfort level, and interests. "
-            "Don't use forms or lists - just have a natural conversation. "
-            "Once you understand their needs, help them choose a stay area and plan day-by-day activities. "
-            "Keep responses conversational and brief (2-4 sentences)."
-            f"\n\nCurrent context: {context}"
-        )
+        system_prompt = f"{CHAT_SYSTEM_PREFIX}\n\nCurrent context: {context}"
         
         messages = [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": message or "Hello! I'd like to plan a trip to Kathmandu."},
         ]
         
-        reply = await _ollama_chat(messages)
-        if not reply or not reply.strip():
-            reply = "Hello! I'm here to help you plan your Kathmandu trip. Tell me about what you're looking for!"
-        
-        return JSONResponse(
-            {
-                "session_id": session_id,
-                "message": reply,
-                "reply": reply,
-                "commands": commands,
-                "trip_state": trip_state,
-                "map_actions": _map_actions_from_state(trip_state),
-                "suggestions": [],
-            }
+        reply = await _llm_or_fallback(
+            _ollama_chat(messages),
+            fallback="Hello! I'm here to help you plan your Kathmandu trip. Tell me about what you're looking for!",
         )
+        
+        return _respond(session_id, reply, trip_state, commands)
 
     if trip_state.get("planning_permission") is True and trip_state.get("ui_stage") == "day_confirm" and message:
         day_index = _current_day_index(trip_state)
         d = _find_day(trip_state, day_index)
         if _looks_like_yes(message):
-            if trip_state.get("hotel") and isinstance(d.get("visits"), list) and 1 <= len(d.get("visits")) <= 2:
+            if trip_state.get("hotel") and 1 <= len(d["visits"]) <= 2:
                 _confirm_day(trip_state, day_index)
                 commands.append({"session.confirmDay": day_index})
                 if _is_trip_complete(trip_state):
                     commands.append({"ui.enableButton": "buildRoute"})
                     reply = _final_trip_summary(trip_state)
                     trip_state["ui_stage"] = "done"
-                    return JSONResponse(
-                        {
-                            "session_id": session_id,
-                            "message": reply,
-                            "reply": reply,
-                            "commands": commands,
-                            "trip_state": trip_state,
-                            "map_actions": _map_actions_from_state(trip_state),
-                            "suggestions": [],
-                        }
-                    )
+                    return _respond(session_id, reply, trip_state, commands)
 
                 next_day = _current_day_index(trip_state)
-                stay_days = None
-                if isinstance(trip_state.get("trip_profile"), dict):
-                    stay_days = trip_state["trip_profile"].get("time_days")
+                stay_days = trip_state["trip_profile"].get("time_days")
                 
                 # Check if we've completed all planned days
                 if isinstance(stay_days, int) and next_day > stay_days:
                     commands.append({"ui.enableButton": "buildRoute"})
                     reply = f"All your {stay_days} days are planned. You can build routes now or ask me questions about your trip."
-                    return JSONResponse(
-                        {
-                            "session_id": session_id,
-                            "message": reply,
-                            "reply": reply,
-                            "commands": commands,
-                            "trip_state": trip_state,
-                            "map_actions": _map_actions_from_state(trip_state),
-                            "suggestions": ["Tell me about my planned places", "How much money should I bring?", "Can I modify my trip?"],
-                        }
-                    )
+                    return _respond(session_id, reply, trip_state, commands, suggestions=TRIP_DONE_SUGGESTIONS)
 
                 trip_state["ui_stage"] = "day_suggest"
-                picks = _candidate_pois(trip_state, limit=3)
+                pick_names = _candidate_names(trip_state)
                 reply = f"Day {day_index} saved. For Day {next_day}, pick up to 2 places. Which first?"
-                return JSONResponse(
-                    {
-                        "session_id": session_id,
-                        "message": reply,
-                        "reply": reply,
-                        "commands": commands,
-                        "trip_state": trip_state,
-                        "map_actions": _map_actions_from_state(trip_state),
-                        "suggestions": [p["name_en"] for p in picks],
-                    }
-                )
+                return _respond(session_id, reply, trip_state, commands, suggestions=pick_names)
         if _looks_like_no(message):
-            visits = d.get("visits")
-            if isinstance(visits, list):
-                for pid in visits:
-                    if isinstance(pid, str):
-                        commands.append({"map.removePin": pid})
-                d["visits"] = []
+            for pid in d["visits"]:
+                commands.append({"map.removePin": pid})
+            d["visits"] = []
             reply = f"No problem. For Day {day_index}, pick up to 2 visiting places (it keeps the map clear and the pace comfortable). Which place should we start with?"
             trip_state["ui_stage"] = "day_suggest"
-            picks = _candidate_pois(trip_state, limit=3)
-            return JSONResponse(
-                {
-                    "session_id": session_id,
-                    "message": reply,
-                    "reply": reply,
-                    "commands": commands,
-                    "trip_state": trip_state,
-                    "map_actions": _map_actions_from_state(trip_state),
-                    "suggestions": [p["name_en"] for p in picks],
-                }
-            )
+            pick_names = _candidate_names(trip_state)
+            return _respond(session_id, reply, trip_state, commands, suggestions=pick_names)
 
     stay_area = _maybe_extract_stay_area(message) if message else None
     if trip_state.get("planning_permission") is True and stay_area:
@@ -1686,26 +1954,21 @@ async def chat(request: Request) -> JSONResponse:
             day_index = _current_day_index(trip_state)
             d = _find_day(trip_state, day_index)
             d["hotelPlaceId"] = "hotel"
-            commands.append({"map.addPin": {"id": "hotel", "lat": float(coords[0]), "lng": float(coords[1]), "type": "hotel", "color": "green", "label": stay_area.title()}})
-            commands.append({"map.zoomTo": {"lat": float(coords[0]), "lng": float(coords[1]), "zoom": 14}})
-            commands.append({"session.storeHotel": {"dayIndex": day_index, "placeId": "hotel", "name_en": stay_area.title(), "lat": float(coords[0]), "lng": float(coords[1])}})
+            lat, lng, label = float(coords[0]), float(coords[1]), stay_area.title()
+            commands.extend(
+                (
+                    {"map.addPin": {"id": "hotel", "lat": lat, "lng": lng, "type": "hotel", "color": "green", "label": label}},
+                    {"map.zoomTo": {"lat": lat, "lng": lng, "zoom": 14}},
+                    {"session.storeHotel": {"dayIndex": day_index, "placeId": "hotel", "name_en": label, "lat": lat, "lng": lng}},
+                )
+            )
             trip_state["ui_stage"] = "day_suggest"
 
             reply = "Perfect — I’ll treat that as your stay point (it becomes the start of each day’s route). Now, for Day 1, which place would you like to add first?"
-            picks = _candidate_pois(trip_state, limit=3)
-            return JSONResponse(
-                {
-                    "session_id": session_id,
-                    "message": reply,
-                    "reply": reply,
-                    "commands": commands,
-                    "trip_state": trip_state,
-                    "map_actions": _map_actions_from_state(trip_state),
-                    "suggestions": [p["name_en"] for p in picks],
-                }
-            )
+            pick_names = _candidate_names(trip_state)
+            return _respond(session_id, reply, trip_state, commands, suggestions=pick_names)
 
-    if _has_buildable_trip(trip_state):
+    if trip_state.get("_buildable", False):
         commands.append({"ui.enableButton": "buildRoute"})
     if _is_trip_complete(trip_state) and trip_state.get("routes"):
         commands.append({"ui.enableButton": "export"})
@@ -1738,87 +2001,43 @@ async def chat(request: Request) -> JSONResponse:
             _set_map_view(trip_state, coords, zoom=15)
             trip_state["stage"] = "exploring"
 
-            pid = _place_id(name)
+            pid = _place_id_for(name)
             day_index = _current_day_index(trip_state)
             ok, reason = _add_visit_to_day(trip_state, day_index, pid)
             if not ok and reason == "day_full":
                 reply = "For map clarity and comfort, I keep it to 2 visiting places per day. If you want, we can move this one to the next day."
-                picks = _candidate_pois(trip_state, limit=3)
-                return JSONResponse(
-                    {
-                        "session_id": session_id,
-                        "message": reply,
-                        "reply": reply,
-                        "commands": commands,
-                        "trip_state": trip_state,
-                        "map_actions": _map_actions_from_state(trip_state),
-                        "suggestions": [p["name_en"] for p in picks],
-                    }
-                )
+                pick_names = _candidate_names(trip_state)
+                return _respond(session_id, reply, trip_state, commands, suggestions=pick_names)
             place = PLACES.get(pid)
             if place:
-                commands.append({"map.addPin": {"id": pid, "lat": place["lat"], "lng": place["lng"], "type": "visit", "color": "blue", "label": place["name_en"]}})
-                commands.append({"map.zoomTo": {"lat": place["lat"], "lng": place["lng"], "zoom": 15}})
-                commands.append({"ui.showImages": {"placeId": pid, "urls": place.get("images") or []}})
-                commands.append({"ui.showReview": {"placeId": pid, "review": str(place.get("review") or "")}})
-                commands.append({"session.addPlaceToDay": {"dayIndex": day_index, "placeId": pid}})
+                commands.extend((*_PLACE_PICK_CMDS[pid], {"session.addPlaceToDay": {"dayIndex": day_index, "placeId": pid}}))
 
             d = _find_day(trip_state, day_index)
-            visits = d.get("visits") if isinstance(d, dict) else None
-            if isinstance(visits, list) and len(visits) >= 2:
+            if len(d["visits"]) >= 2:
                 preview = _day_preview_text(trip_state, day_index) or ""
                 trip_state["ui_stage"] = "day_confirm"
                 reply = preview + "\n\nSave this as Day " + str(day_index) + "?"
-                return JSONResponse(
-                    {
-                        "session_id": session_id,
-                        "message": reply,
-                        "reply": reply,
-                        "commands": commands,
-                        "trip_state": trip_state,
-                        "map_actions": _map_actions_from_state(trip_state),
-                        "suggestions": ["Yes", "No"],
-                    }
-                )
+                return _respond(session_id, reply, trip_state, commands, suggestions=["Yes", "No"])
 
             trip_state["ui_stage"] = "day_suggest"
-            picks = _candidate_pois(trip_state, limit=3)
+            pick_names = _candidate_names(trip_state)
             short_story = str(place.get("storyShort") or "").strip() if isinstance(place, dict) else ""
             reply = (
                 (f"{place.get('name_en')}: {short_story}\n\n" if short_story and isinstance(place, dict) else "")
                 + f"I recommend max 2 visiting places per day (map clarity and comfort). Which second place should we add for Day {day_index}?"
             )
-            return JSONResponse(
-                {
-                    "session_id": session_id,
-                    "message": reply,
-                    "reply": reply,
-                    "commands": commands,
-                    "trip_state": trip_state,
-                    "map_actions": _map_actions_from_state(trip_state),
-                    "suggestions": [p["name_en"] for p in picks],
-                }
-            )
+            return _respond(session_id, reply, trip_state, commands, suggestions=pick_names)
 
         if et == "set_hotel":
             reply = (
                 "For this prototype, please choose your stay area in chat (Thamel / Near Boudha / Near Durbar Square). "
                 "Once you pick one, I’ll set it as your start point (green pin)."
             )
-            return JSONResponse(
-                {
-                    "session_id": session_id,
-                    "message": reply,
-                    "reply": reply,
-                    "commands": commands,
-                    "trip_state": trip_state,
-                    "map_actions": _map_actions_from_state(trip_state),
-                    "suggestions": ["I'm staying in Thamel", "I'm staying near Boudha", "I'm staying near Durbar Square"],
-                }
-            )
+            return _respond(session_id, reply, trip_state, commands, suggestions=["I'm staying in Thamel", "I'm staying near Boudha", "I'm staying near Durbar Square"])
 
         if et == "create_route":
             trip_state["routes"] = await _build_routes_for_confirmed_days(trip_state)
+            _bump_map_version(trip_state)
             trip_state["stage"] = "planning" if trip_state.get("routes") else trip_state.get("stage", "exploring")
 
             if not _is_trip_complete(trip_state):
@@ -1829,17 +2048,7 @@ async def chat(request: Request) -> JSONResponse:
                 commands.append({"ui.enableButton": "export"})
                 reply = "Done — your day-by-day routes are ready. You can now export each day to Google Maps."
 
-            return JSONResponse(
-                {
-                    "session_id": session_id,
-                    "message": reply,
-                    "reply": reply,
-                    "commands": commands,
-                    "trip_state": trip_state,
-                    "map_actions": _map_actions_from_state(trip_state),
-                    "suggestions": [],
-                }
-            )
+            return _respond(session_id, reply, trip_state, commands)
 
     # Remove all remaining static fallbacks - let the main LLM handler take care of everything
 
@@ -1847,69 +2056,38 @@ async def chat(request: Request) -> JSONResponse:
     if (trip_state.get("planning_permission") is True and 
         trip_state.get("ui_stage") == "done" and 
         message and 
-        _has_buildable_trip(trip_state)):
+        trip_state.get("_buildable", False)):
         
-        reply = await _handle_completed_trip_questions(trip_state, message, fallback="Your trip is all planned! You can build routes or ask me about your itinerary.")
+        done_fallback = "Your trip is all planned! You can build routes or ask me about your itinerary."
+        reply = await _llm_or_fallback(
+            _handle_completed_trip_questions(trip_state, message, fallback=done_fallback), fallback=done_fallback
+        )
         commands.append({"ui.enableButton": "buildRoute"})
         if _is_trip_complete(trip_state) and trip_state.get("routes"):
             commands.append({"ui.enableButton": "export"})
         
-        return JSONResponse(
-            {
-                "session_id": session_id,
-                "message": reply,
-                "reply": reply,
-                "commands": commands,
-                "trip_state": trip_state,
-                "map_actions": _map_actions_from_state(trip_state),
-                "suggestions": ["Tell me about my planned places", "How much money should I bring?", "Can I modify my trip?"],
-            }
-        )
+        return _respond(session_id, reply, trip_state, commands, suggestions=TRIP_DONE_SUGGESTIONS)
 
     if trip_state.get("planning_permission") is True:
         day_index = _current_day_index(trip_state)
-        stay_days = None
-        if isinstance(trip_state.get("trip_profile"), dict):
-            stay_days = trip_state["trip_profile"].get("time_days")
-        if isinstance(stay_days, int) and day_index > stay_days and _has_buildable_trip(trip_state):
+        stay_days = trip_state["trip_profile"].get("time_days")
+        if isinstance(stay_days, int) and day_index > stay_days and trip_state.get("_buildable", False):
             commands.append({"ui.enableButton": "buildRoute"})
             # Mark done, but route subsequent messages through the completed-trip handler.
             trip_state["ui_stage"] = "done"
-            reply = await _handle_completed_trip_questions(
-                trip_state,
-                message,
-                fallback=f"All your {stay_days} days are planned. You can build routes now or ask me questions about your trip.",
-            )
-            return JSONResponse(
-                {
-                    "session_id": session_id,
-                    "message": reply,
-                    "reply": reply,
-                    "commands": commands,
-                    "trip_state": trip_state,
-                    "map_actions": _map_actions_from_state(trip_state),
-                    "suggestions": ["Tell me about my planned places", "How much money should I bring?", "Can I modify my trip?"],
-                }
+            done_fallback = f"All your {stay_days} days are planned. You can build routes now or ask me questions about your trip."
+            reply = await _llm_or_fallback(
+                _handle_completed_trip_questions(trip_state, message, fallback=done_fallback), fallback=done_fallback
             )
+            return _respond(session_id, reply, trip_state, commands, suggestions=TRIP_DONE_SUGGESTIONS)
 
         d = _find_day(trip_state, day_index)
-        visits = d.get("visits") if isinstance(d, dict) else None
         if message and trip_state.get("ui_stage") == "day_suggest" and _looks_like_save_day(message):
-            if isinstance(visits, list) and 1 <= len(visits) <= 2:
+            if 1 <= len(d["visits"]) <= 2:
                 preview = _day_preview_text(trip_state, day_index) or ""
                 trip_state["ui_stage"] = "day_confirm"
                 reply = preview + "\n\nSave this as Day " + str(day_index) + "?"
-                return JSONResponse(
-                    {
-                        "session_id": session_id,
-                        "message": reply,
-                        "reply": reply,
-                        "commands": commands,
-                        "trip_state": trip_state,
-                        "map_actions": _map_actions_from_state(trip_state),
-                        "suggestions": ["Yes", "No"],
-                    }
-                )
+                return _respond(session_id, reply, trip_state, commands, suggestions=["Yes", "No"])
 
         # Remove all profile collection logic - LLM handles everything
         # No more static questions or forms
@@ -1929,23 +2107,14 @@ async def chat(request: Request) -> JSONResponse:
                 {"role": "user", "content": message or "Tell me about this day"},
             ]
             
-            reply = await _ollama_chat(messages)
-            if not reply or not reply.strip():
-                reply = f"Day {day_index} is already confirmed. What would you like to know about it?"
-                
-            return JSONResponse(
-                {
-                    "session_id": session_id,
-                    "message": reply,
-                    "reply": reply,
-                    "commands": commands,
-                    "trip_state": trip_state,
-                    "map_actions": _map_actions_from_state(trip_state),
-                    "suggestions": [],
-                }
+            reply = await _llm_or_fallback(
+                _ollama_chat(messages),
+                fallback=f"Day {day_index} is already confirmed. What would you like to know about it?",
             )
+                
+            return _respond(session_id, reply, trip_state, commands)
 
-        picks = _candidate_pois(trip_state, limit=3)
+        pick_names = _candidate_names(trip_state)
         place_guess = _looks_like_place_name(message) if message else None
         poi = _find_poi_by_name(place_guess) if place_guess else None
         if not poi and place_guess:
@@ -1955,94 +2124,51 @@ async def chat(request: Request) -> JSONResponse:
             coords = poi.get("coordinates")
             if not (isinstance(coords, list) and len(coords) == 2):
                 coords = [KATHMANDU_CENTER[0], KATHMANDU_CENTER[1]]
-            pid = _place_id(name)
+            pid = _place_id_for(name)
             ok, reason = _add_visit_to_day(trip_state, day_index, pid)
             if not ok and reason == "day_full":
                 reply = "For map clarity and comfort, I keep it to 2 visiting places per day. If you want, we can move this one to the next day."
-                return JSONResponse(
-                    {
-                        "session_id": session_id,
-                        "message": reply,
-                        "reply": reply,
-                        "commands": commands,
-                        "trip_state": trip_state,
-                        "map_actions": _map_actions_from_state(trip_state),
-                        "suggestions": [p["name_en"] for p in picks],
-                    }
-                )
+                return _respond(session_id, reply, trip_state, commands, suggestions=pick_names)
 
             _upsert_selected_place(trip_state, name, coords)
             _set_map_view(trip_state, coords, zoom=15)
             place = PLACES.get(pid)
             if place:
-                commands.append({"map.addPin": {"id": pid, "lat": place["lat"], "lng": place["lng"], "type": "visit", "color": "blue", "label": place["name_en"]}})
-                commands.append({"map.zoomTo": {"lat": place["lat"], "lng": place["lng"], "zoom": 15}})
-                commands.append({"ui.showImages": {"placeId": pid, "urls": place.get("images") or []}})
-                commands.append({"ui.showReview": {"placeId": pid, "review": str(place.get("review") or "")}})
-                commands.append({"session.addPlaceToDay": {"dayIndex": day_index, "placeId": pid}})
+                commands.extend((*_PLACE_PICK_CMDS[pid], {"session.addPlaceToDay": {"dayIndex": day_index, "placeId": pid}}))
 
             d = _find_day(trip_state, day_index)
-            visits = d.get("visits") if isinstance(d, dict) else None
-            if isinstance(visits, list) and len(visits) >= 2:
+            if len(d["visits"]) >= 2:
                 preview = _day_preview_text(trip_state, day_index) or ""
                 trip_state["ui_stage"] = "day_confirm"
                 reply = preview + "\n\nSave this as Day " + str(day_index) + "?"
-                return JSONResponse(
-                    {
-                        "session_id": session_id,
-                        "message": reply,
-                        "reply": reply,
-                        "commands": commands,
-                        "trip_state": trip_state,
-                        "map_actions": _map_actions_from_state(trip_state),
-                        "suggestions": ["Yes", "No"],
-                    }
-                )
+                return _respond(session_id, reply, trip_state, commands, suggestions=["Yes", "No"])
 
             trip_state["ui_stage"] = "day_suggest"
-            remaining = _candidate_pois(trip_state, limit=3)
+            remaining = _candidate_names(trip_state)
             reply = f"Added {name}. I recommend max 2 visiting places per day (map clarity and comfort). Which second place should we add for Day {day_index}?"
-            return JSONResponse(
-                {
-                    "session_id": session_id,
-                    "message": reply,
-                    "reply": reply,
-                    "commands": commands,
-                    "trip_state": trip_state,
-                    "map_actions": _map_actions_from_state(trip_state),
-                    "suggestions": [p["name_en"] for p in remaining] + [f"Save Day {day_index}"],
-                }
-            )
+            return _respond(session_id, reply, trip_state, commands, suggestions=remaining + [f"Save Day {day_index}"])
 
         trip_state["ui_stage"] = "day_suggest"
-        picks = _candidate_pois(trip_state, limit=3)
+        pick_names = _candidate_names(trip_state)
         # Use LLM to narrate day planning with local stories
         stories = await _get_relevant_stories(f"Day {day_index} planning places to visit")
-        place_names = [p["name_en"] for p in picks]
-        reply = await _narrate_response(
-            trip_state,
-            message or f"What places should we visit on Day {day_index}?",
-            "day_planning",
-            allowed_choices=place_names,
-            retrieved_stories=stories
+        reply = await _llm_or_fallback(
+            _narrate_response(
+                trip_state,
+                message or f"What places should we visit on Day {day_index}?",
+                "day_planning",
+                allowed_choices=pick_names,
+                retrieved_stories=stories
+            ),
+            fallback="Let's plan your day! I'll suggest places that match your interests and keep the pace comfortable.",
         )
         # Add the specific question about choosing places
-        reply += f"\n\nFor Day {day_index}, pick up to 2 places: {', '.join(place_names)}. Which first?"
+        reply += f"\n\nFor Day {day_index}, pick up to 2 places: {', '.join(pick_names)}. Which first?"
         
         # Fallback if LLM response is empty
         if not reply or not reply.strip():
-            reply = f"For Day {day_index}, pick up to 2 places: {', '.join(place_names)}. Which first?"
-        return JSONResponse(
-            {
-                "session_id": session_id,
-                "message": reply,
-                "reply": reply,
-                "commands": commands,
-                "trip_state": trip_state,
-                "map_actions": _map_actions_from_state(trip_state),
-                "suggestions": [p["name_en"] for p in picks],
-            }
-        )
+            reply = f"For Day {day_index}, pick up to 2 places: {', '.join(pick_names)}. Which first?"
+        return _respond(session_id, reply, trip_state, commands, suggestions=pick_names)
 
     # Remove final fallback - let main LLM handler catch everything
 
@@ -2054,8 +2180,23 @@ routes = [
     Route("/api/places", endpoint=places, methods=["GET"]),
     Route("/api/chat", endpoint=chat, methods=["POST"]),
     Route("/api/export", endpoint=export_plan, methods=["GET"]),
-    Mount("/static", app=StaticFiles(directory=str(STATIC_DIR)), name="static"),
+    Mount("/static", app=CachedStaticFiles(directory=str(STATIC_DIR)), name="static"),
 ]
 
 
-app = Starlette(routes=routes)
+@contextlib.asynccontextmanager
+async def lifespan(app: Starlette) -> AsyncIterator[None]:
+    _http_client()
+    warmup = asyncio.create_task(_warm_ollama()) if os.environ.get("OLLAMA_WARMUP", "1") != "0" else None
+    try:
+        yield
+    finally:
+        if warmup is not None:
+            warmup.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await warmup
+        if _HTTP is not None:
+            await _HTTP.aclose()
+
+
+app = Starlette(routes=routes, lifespan=lifespan)